@@ -95,6 +95,36 @@ class LowLevelSerPort:
   def avail(self):
     return self.port.in_waiting
 
+  # block until data arrives or timeout passes; ports without a file descriptor (some URL handlers) fall back to a short sleep
+  def waitavail(self,timeout):
+    if self.port.in_waiting: return True
+    try: r,_,_=select([self.port],[],[],timeout)
+    except Exception: sleep(min(timeout,0.05));return self.port.in_waiting>0
+    return r!=[]
+
+  # ask the tty driver for ASYNC_LOW_LATENCY, USB-serial adapters otherwise batch incoming data for up to 16ms (Linux only)
+  def setlowlatency(self):
+    ok=self.setlatencytimer()
+    try: self.port.set_low_latency_mode(True)
+    except Exception as e:
+      if self.verbconn: print('SERPORT:lowlatency:unsupported:',e,file=stdlog)
+      return ok
+    if self.verbconn: print('SERPORT:lowlatency',file=stdlog)
+    return True
+
+  # FTDI and similar adapters expose their 16ms buffer timer in sysfs; needs write access (root or udev rule)
+  def setlatencytimer(self,ms=1):
+    import os
+    name=os.path.basename(os.path.realpath(self.serport)) # follows /dev/serial/by-id/... links
+    path=f'/sys/bus/usb-serial/devices/{name}/latency_timer'
+    try:
+      with open(path,'w') as f: f.write(str(ms))
+    except OSError as e:
+      if self.verbconn: print('SERPORT:latency_timer:unavailable:',e,file=stdlog)
+      return False
+    if self.verbconn: print('SERPORT:latency_timer',ms,'ms',file=stdlog)
+    return True
+
 
 
 ####################
@@ -149,6 +179,15 @@ class LowLevelTcpPort:
     if self.verbconn: print('SOCK:closed',file=stdlog)
     self.sock.close()
 
+  # disable Nagle, so the short command packets go out immediately
+  def setlowlatency(self):
+    try: self.sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+    except Exception as e:
+      if self.verbconn: print('SOCK:lowlatency:unsupported:',e,file=stdlog)
+      return False
+    if self.verbconn: print('SOCK:lowlatency',file=stdlog)
+    return True
+
 
   def send(self,raw,showpacket=None):
     if showpacket!=None and self.verbport: showpacket(raw,name='SOCK:SEND',check=False,file=stdlog)
@@ -172,6 +211,11 @@ class LowLevelTcpPort:
     self.sock.settimeout(self.timeout)
     return n
 
+  # block until data arrives or timeout passes, avail() still does the reading
+  def waitavail(self,timeout):
+    r,_,_=select([self.sock],[],[],timeout)
+    return r!=[]
+
   # actual reading happens here, do recv() if result nonzero!
   def avail(self):
     #return self.port.in_waiting
@@ -247,6 +291,7 @@ class Instr_Atorch:
 
   out=None
   stopoff=False
+  queryerrs=0 # failed PX100 queries since the last cmd_readstate() start
 
   instrtype=None
   ADU=2 # read from instrtype, this is default; possibly specify in config
@@ -489,6 +534,16 @@ class Instr_Atorch:
     self.longpacketcntold=self.longpacketcnt
     return True
 
+  # wait for the next status packet, sleeping in select() until bytes arrive; timeout=None waits forever
+  def waitupdate(self,timeout=None):
+    end=None if timeout is None else monotonic()+timeout
+    while not self.gotupdate():
+      left=1.0 if end is None else end-monotonic()
+      if left<=0: return False
+      self.comm.waitavail(min(left,1.0))
+      self.recvdata()
+    return True
+
   def recvdata(self):
     avail=self.comm.avail()
     #print(avail)
@@ -546,10 +601,12 @@ class Instr_Atorch:
     r=self.send_px100cmd_raw(cmd)
     if not r:
       print(f'ERR: no PX100 response ({id})',file=stdlog)
+      self.queryerrs+=1
       return None
     if self.packet[0]!=0xCA or self.packet[1]!=0xCB or self.packet[5]!=0xCE or self.packet[6]!=0xCF:
       self.showpacket(self.packet,name=f'ERR: bad PX100 response ({id})',force=True)
       self.packet=[]
+      self.queryerrs+=1
       return None
     self.showpacket(self.packet[2:5],name=f'PX100-value ({id})')
     val=getint24(self.packet,2)
@@ -575,6 +632,13 @@ class Instr_Atorch:
     r=self.send_px100cmd_raw(self.CMD_ONOFF,[val,0])
     if not r: print('ERR: cannot send command!',file=stdlog)
 
+  # current, then cutoff (if given), then output; one frame each, the protocol has no multi-register write
+  # stops at the first command the load does not acknowledge, so it is never switched on with stale limits
+  def cmd_setup_discharge(self,current,cutoff=None,on=1):
+    if not self.send_px100cmd_raw(self.CMD_SETCURRENT,self.float2pair(current)): return False
+    if cutoff!=None and not self.send_px100cmd_raw(self.CMD_SETCUTOFF,self.float2pair(cutoff)): return False
+    return self.send_px100cmd_raw(self.CMD_ONOFF,[on,0])
+
   def cmd_resetcounters(self):
     r=self.send_px100cmd_raw(self.CMD_RESET)
     if not r: print('ERR: cannot send command!',file=stdlog)
@@ -605,6 +669,12 @@ class Instr_Atorch:
   def cmd_gettemp(self):
     return self.px100_query(self.CMD_GETTEMP,id='temp')
 
+  # the live readings in one call (V, A, mAh, mWh, degC); the protocol has no combined query, so these are still five exchanges
+  def cmd_getall(self):
+    return {'voltage':self.cmd_getvolt(),'current':self.cmd_getamp(),
+            'capacity_mah':self.cmd_getah(div=1),'energy_mwh':self.cmd_getwh(div=1),
+            'temperature':self.cmd_gettemp()}
+
   def cmd_button(self,butt):
     return self.send_atorch_raw(butt,d=[0,0,0,0])
 
@@ -612,6 +682,7 @@ class Instr_Atorch:
   def cmd_readstate(self,energy=True,limits=True,temp=True,timestr=None,short=True,listenonly=False):
     #return self.state
     a={}
+    self.queryerrs=0 # nonzero afterwards if any value could not be read
 
     if timestr!=None: a['time']=timestr
     if not listenonly:
@@ -1251,7 +1322,7 @@ if __name__=="__main__":
   if pload.isparm('WAIT') or ('waitcomm' in pload.conf and pload.conf['waitcomm']=='1'):
     if pload.verbrun:
       print('waiting for incoming data',file=stdlog)
-    while not pload.instr.gotupdate(): sleep(0.05);pload.instr.recvdata()
+    pload.instr.waitupdate()
 
   if False:
     pload.handlecommands(cmds)
@@ -4,35 +4,240 @@ DL24P Web Server - Flask-based REST API for the HTML GUI
 Bridges the index.html frontend with dl24.py backend
 """
 
-from flask import Flask, jsonify, request, send_from_directory
+import os
+import logging
+
+# Server mode: 'threading' (Werkzeug, one thread per client), 'gevent'
+# (gevent-websocket) or 'eventlet', both one greenlet per client. These need
+# their monkey patching before anything else opens sockets or starts threads.
+ASYNC_MODE = os.environ.get('DL24_ASYNC_MODE', 'threading')
+if ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, Response, jsonify, request, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 import threading
 import time
-import sys
-import os
+import queue
+import random
+import itertools
+import re
+import signal
+from array import array
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+log = logging.getLogger('dl24')
 
 # Import the dl24 classes
 from dl24 import LowLevelSerPort, LowLevelTcpPort, Instr_Atorch, PowerLoad
 
-# Import serial port listing
+# Serial port listing, imported by load_list_ports() on first use of /api/ports
+# (False: not tried yet, None: unavailable)
+list_ports = False
+
+def load_list_ports():
+    """Import serial.tools.list_ports once and return it, None if unavailable"""
+    global list_ports
+    if list_ports is False:
+        try:
+            from serial.tools import list_ports as module
+        except ImportError:
+            module = None
+        list_ports = module
+    return list_ports
+
+# Advisory file locks for the config file (not available on Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Optional C JSON encoder for the frequently polled responses and WebSocket frames
 try:
-    from serial.tools import list_ports
+    import orjson
 except ImportError:
-    list_ports = None
+    orjson = None
+
+class OrjsonModule:
+    """Minimal json module stand-in backed by orjson, for SocketIO"""
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+def not_modified(etag):
+    """Return a 304 response if the client already has etag, else None"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, so jsonify() and request.json use it"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
 
 app = Flask(__name__, static_folder='.')
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+    socketio = SocketIO(app, async_mode=ASYNC_MODE, cors_allowed_origins="*", json=OrjsonModule)
+else:
+    socketio = SocketIO(app, async_mode=ASYNC_MODE, cors_allowed_origins="*")
+
+# Serial I/O is owned by the update_data thread, other threads queue jobs for it
+device_jobs = queue.SimpleQueue()
+DEVICE_JOB_TIMEOUT = 60  # Seconds to wait for a queued device job
+
+# Last device state read by update_data, rebound (never mutated) on every poll
+device_snapshot = {}
+# Bumped by update_data whenever it sends a new status_update, used as ETag for /api/status
+status_version = 0
+# Consistent view of the shared state for request handlers. Only rebound (by
+# publish_state() on the update thread), never mutated: take one reference and
+# read everything from it, no lock needed.
+state_snapshot = {
+    'version': 0, 'running': False, 'connected': False, 'device': {}, 'data': {},
+    'health': {}, 'serport': '', 'host': '', 'port': ''
+}
+
+# Default number of recorded samples kept per test (24h at 2s interval)
+DATA_RING_SIZE = 43200
+CSV_CHUNK_SIZE = 65536  # Bytes per chunk when streaming /api/data.csv
+
+# Generation numbers of DataRing instances, a new ring never reuses an ETag
+ring_generations = itertools.count()
+
+class DataRing:
+    """Preallocated ring buffer of recorded samples, stored column-wise
+
+    A ring is never cleared in place while other threads may hold it: a new
+    session gets a new ring through replace_data_ring().
+    """
+    COLUMNS = ('time', 'timestamp', 'voltage', 'current', 'capacity')
+    CSV_ROW = '{:.1f},{:.3f},{:.3f},{:.3f},{:.1f}\n'  # one CSV line, fields as in COLUMNS
+
+    def __init__(self, size=None):
+        self.size = size or DATA_RING_SIZE
+        self.cols = {name: array('d', [0.0]) * self.size for name in self.COLUMNS}
+        self.written = 0  # total samples ever written, oldest get overwritten
+        self.generation = next(ring_generations)  # for ETags
+
+    def discard(self):
+        """Called once the ring has been replaced, readers may still hold it"""
+
+    def etag(self):
+        """Tag changing whenever samples are added or dropped"""
+        return f'{self.generation}-{self.written}'
+
+    def __len__(self):
+        return min(self.written, self.size)
+
+    def append(self, runtime, timestamp, voltage, current, capacity):
+        i = self.written % self.size
+        cols = self.cols
+        cols['time'][i] = runtime
+        cols['timestamp'][i] = timestamp
+        cols['voltage'][i] = voltage
+        cols['current'][i] = current
+        cols['capacity'][i] = capacity
+        self.written += 1
+
+    def snapshot(self):
+        """Copy all columns in chronological order, cut at one written count
+
+        Returns (written, [array per column in COLUMNS order]); every array has
+        the same length. The update thread may append meanwhile, so written is
+        read once, and once wrapped the oldest slot (the next one to be
+        overwritten) is left out.
+        """
+        written = self.written
+        size = self.size
+        cols = [self.cols[name] for name in self.COLUMNS]
+        if written <= size:
+            return written, [array('d', col[:written]) for col in cols]
+        end = written % size
+        return written, [array('d', col[end + 1:]) + array('d', col[:end]) for col in cols]
+
+    def to_list(self, columns):
+        """Build the per-sample dicts served by /api/data from snapshot() columns"""
+        names = self.COLUMNS
+        return [dict(zip(names, row)) for row in zip(*columns)]
+
+    def to_columns(self, columns):
+        """Return {column: [values]} from snapshot() columns, without per-sample dicts"""
+        return {name: col.tolist() for name, col in zip(self.COLUMNS, columns)}
+
+    def to_bytes(self, columns):
+        """Return snapshot() columns back to back as native float64 (Float64Array in JS)"""
+        return b''.join(col.tobytes() for col in columns)
+
+class SharedDataRing(DataRing):
+    """DataRing keeping its columns in a shared memory block for other processes
+
+    Layout: int64 size, written, generation, then the float64 columns in
+    COLUMNS order, size values each. Readers attach by the name served at
+    /api/shm; every new ring creates a new block (and a new name).
+    """
+    HEADER = 3  # int64 header slots
+
+    def __init__(self, size=None):
+        self.size = size or DATA_RING_SIZE
+        n = len(self.COLUMNS) * self.size
+        self.shm = shared_memory.SharedMemory(create=True, size=(self.HEADER + n) * 8)
+        self.header = self.shm.buf[:self.HEADER * 8].cast('q')
+        data = self.shm.buf[self.HEADER * 8:(self.HEADER + n) * 8].cast('d')
+        self.cols = {name: data[i * self.size:(i + 1) * self.size] for i, name in enumerate(self.COLUMNS)}
+        self.written = 0
+        self.generation = next(ring_generations)
+        self.header[0] = self.size
+        self.header[1] = 0
+        self.header[2] = self.generation
+
+    def discard(self):
+        """Unlink the block's name; the mapping stays valid for anyone still
+        holding this ring and goes away with the last reference"""
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass  # discarded before
+
+    def __del__(self):
+        # Last reference gone: views into the block go first, then the mapping
+        for view in self.cols.values():
+            view.release()
+        self.header.release()
+        self.shm.close()
 
-# Thread lock for serial port access
-serial_lock = threading.Lock()
+    def append(self, runtime, timestamp, voltage, current, capacity):
+        super().append(runtime, timestamp, voltage, current, capacity)
+        self.header[1] = self.written  # published after the values themselves
 
 # Global state
 test_state = {
     'running': False,
-    'start_time': None,
-    'data_points': [],
+    'start_time': None,  # time.monotonic() at test start
+    # DL24_SHM=1 publishes the samples in shared memory, see /api/shm
+    'data_points': SharedDataRing() if os.environ.get('DL24_SHM') == '1' else DataRing(),
     'current_data': {
         'voltage': 0.0,
         'current': 0.0,
@@ -54,16 +259,184 @@ connection_health = {
     'connection_reset_count': 0,
     'last_reset_time': 0,
     'min_reset_interval': 30,  # Seconds between connection resets
-    'update_interval': 2.0,  # Start with 2 seconds, increase if problems persist
+    'max_reset_interval': 300,  # Cap for the backoff between failing connection resets
+    'reset_delay': 30,  # Current delay before the next automatic reset
+    'update_interval': 2.0,  # Start with 2 seconds, back off exponentially if problems persist
+    'min_update_interval': 2.0,  # Minimum update interval
     'max_update_interval': 10.0,  # Maximum update interval
+    'poll_backoff_base': 1.3,  # Update interval factor per failed poll
     'is_connected': False,
     'last_error': None,
     'reconnect_attempts': 0
 }
 update_thread = None
 test_thread = None
+# (voltage, current) of every poll, handed from update_data to the running test_monitor
+monitor_samples = None
+MONITOR_QUEUE_SIZE = 256
 last_heartbeat = 0
 HEARTBEAT_TIMEOUT = 15  # Seconds without heartbeat before auto-stop
+MAX_TEST_TIME = 24 * 3600  # Longest time limit /api/start accepts, as in the page's Max Time field
+STATUS_EMIT_KEEPALIVE = 1.0  # Seconds after which an unchanged status_update is re-sent anyway
+# status_update payload, updated in place by update_data; emit() encodes it
+# before returning, so reusing the dicts between emits is safe
+status_payload = {
+    'connected': False,
+    'running': False,
+    'load_on': 0,
+    'cutoff_voltage': 0.0,
+    'set_current': 0.0,
+    'data': None,
+    'connection_health': {
+        'consecutive_failures': 0,
+        'last_error': None,
+        'reconnect_attempts': 0,
+        'update_interval': 0.0
+    }
+}
+# /api/stream subscribers, one queue of encoded Server-Sent Events frames each
+stream_subscribers = set()
+stream_lock = threading.Lock()
+STREAM_QUEUE_SIZE = 64  # Frames buffered per subscriber before new ones are dropped for it
+STREAM_KEEPALIVE = 15.0  # Seconds without frames after which a comment line is sent
+
+MIN_POLL_INTERVAL = 0.2  # Shortest poll interval when closing in on the cutoff voltage
+POLLS_BEFORE_CUTOFF = 20  # Polls to place within the expected time left until cutoff
+IDLE_POLL_BUDGET = 20  # Polls to place over the usual time between state changes while idle
+IDLE_CHANGE_HISTORY = 32  # Observed idle state-change intervals the schedule is built from
+# cmd_readstate() arguments for a full reading: output, V, A, Ah, Wh, Iset, Vcut and temperature
+READSTATE_FULL = dict(energy=True, limits=True, temp=True, short=False)
+
+def new_data_ring(size=None):
+    """New, empty ring of the kind in use, not yet recorded into"""
+    return type(test_state['data_points'])(size)
+
+def replace_data_ring(ring=None):
+    """Start recording into ring (a new default-sized one if None)
+
+    The update thread and request handlers look the ring up in test_state for
+    every use, so swapping the reference is enough; whoever still holds the
+    old ring keeps working on it until done.
+    """
+    old = test_state['data_points']
+    test_state['data_points'] = ring if ring is not None else new_data_ring()
+    old.discard()
+
+def device_call(func, *args, **kwargs):
+    """Run func on the thread owning the serial port and return its result"""
+    if update_thread is None or threading.current_thread() is update_thread or not update_thread.is_alive():
+        return func(*args, **kwargs)
+    job = Future()
+    device_jobs.put((job, func, args, kwargs))
+    return job.result(timeout=DEVICE_JOB_TIMEOUT)
+
+def publish_state():
+    """Rebind state_snapshot to a fresh copy of the current state"""
+    global state_snapshot
+    conf = getattr(pload, 'conf', None) or {}  # pload may be None or not configured yet
+    state_snapshot = {
+        'version': status_version,
+        'running': test_state['running'],
+        'connected': connection_health['is_connected'],
+        'device': device_snapshot if pload and pload.instr and pload.instr.comm else {},
+        'data': dict(test_state['current_data']),  # runtime is updated in place
+        'health': {
+            'consecutive_failures': connection_health['consecutive_failures'],
+            'last_error': connection_health['last_error'],
+            'reconnect_attempts': connection_health['reconnect_attempts'],
+            'update_interval': connection_health['update_interval']
+        },
+        'serport': conf.get('serport', ''),
+        'host': conf.get('host', ''),
+        'port': conf.get('port', '')
+    }
+
+def publish_stream(payload):
+    """Encode payload once and queue it for every /api/stream subscriber"""
+    if not stream_subscribers:
+        return
+    frame = f'data: {app.json.dumps(payload)}\n\n'
+    with stream_lock:
+        for subscriber in stream_subscribers:
+            try:
+                subscriber.put_nowait(frame)
+            except queue.Full:
+                pass  # Slow client, it misses this frame
+
+def wake_updater():
+    """Make the update thread poll the device now instead of waiting out its interval"""
+    device_jobs.put(None)
+
+def run_device_jobs(timeout):
+    """Wait up to timeout for queued device jobs and execute all pending ones
+
+    Returns True if anything was dequeued (a job or a wake-up).
+    """
+    try:
+        pending = device_jobs.get(timeout=timeout)
+    except queue.Empty:
+        return False
+    while True:
+        # None is a wake-up from wake_updater(): nothing to run, just return and poll
+        if pending is not None and pending[0].set_running_or_notify_cancel():
+            job, func, args, kwargs = pending
+            try:
+                job.set_result(func(*args, **kwargs))
+            except Exception as e:
+                job.set_exception(e)
+        try:
+            pending = device_jobs.get_nowait()
+        except queue.Empty:
+            return True
+
+def backoff(interval, factor, lower, upper):
+    """Scale interval by factor with +-20% jitter, clamped to [lower, upper]"""
+    return min(upper, max(lower, interval * factor * random.uniform(0.8, 1.2)))
+
+def adaptive_poll_interval(voltage_history, cutoff_voltage):
+    """Poll interval spreading POLLS_BEFORE_CUTOFF polls over the expected time to cutoff
+
+    voltage_history holds (time, voltage) samples of the running discharge.
+    Returns None when the voltage is not clearly falling, so the caller keeps
+    its regular interval.
+    """
+    n = len(voltage_history)
+    if n < voltage_history.maxlen or cutoff_voltage <= 0:
+        return None
+    # Least-squares slope dV/dt over the history window
+    mean_t = sum(t for t, v in voltage_history) / n
+    mean_v = sum(v for t, v in voltage_history) / n
+    var_t = sum((t - mean_t) ** 2 for t, v in voltage_history)
+    if var_t <= 0:
+        return None
+    slope = sum((t - mean_t) * (v - mean_v) for t, v in voltage_history) / var_t
+    if slope > -1e-4:
+        return None  # flat or rising, slope is just noise
+    time_to_cutoff = (voltage_history[-1][1] - cutoff_voltage) / -slope
+    return min(max(MIN_POLL_INTERVAL, time_to_cutoff / POLLS_BEFORE_CUTOFF),
+               connection_health['max_update_interval'])
+
+def idle_poll_schedule(change_intervals):
+    """Poll offsets after a state change, placed at IDLE_POLL_BUDGET quantiles of change_intervals
+
+    Each gap between two polls then holds the same share of the observed
+    changes, so polls are dense where changes usually happen and sparse in
+    the long tail. Returns None until enough changes have been seen.
+    """
+    n = len(change_intervals)
+    if n < 8:
+        return None
+    ordered = sorted(change_intervals)
+    return [ordered[min(n - 1, j * n // IDLE_POLL_BUDGET)] for j in range(1, IDLE_POLL_BUDGET + 1)]
+
+def idle_poll_interval(schedule, since_change):
+    """Time until the next scheduled poll, since_change seconds after the last state change"""
+    lower = connection_health['min_update_interval']
+    upper = connection_health['max_update_interval']
+    for offset in schedule:
+        if offset > since_change:
+            return min(max(lower, offset - since_change), upper)
+    return upper  # past the usual change times, poll at the slowest rate
 
 def init_device():
     """Initialize the DL24P device connection"""
@@ -75,22 +448,25 @@ def init_device():
 
         # Read config file - use dl24.cfg instead of dl24_webserver.cfg
         if not pload.readconf(name='dl24'):
-            print('Warning: Could not read config file, using defaults', file=sys.stderr)
+            log.warning('Could not read config file, using defaults')
 
-        print(f'Config loaded: {pload.conf}', file=sys.stderr)
+        log.info('Config loaded: %s', pload.conf)
 
         # Check if we have connection settings
         if not pload.conf.get('serport') and not pload.conf.get('host'):
-            print('No serial port or host configured', file=sys.stderr)
-            print('Please configure connection in the web interface', file=sys.stderr)
+            log.info('No serial port or host configured')
+            log.info('Please configure connection in the web interface')
             return False
 
         # Initialize port - catch errors gracefully
         try:
             pload.initport()
             pload.instr.connect()
+            if not pload.instr.comm.setlowlatency():
+                # Bluetooth rfcomm ports have no such setting; for USB adapters see WEB_GUI.md
+                log.info('Low-latency mode not available for this port')
         except Exception as port_error:
-            print(f'Could not connect to port: {port_error}', file=sys.stderr)
+            log.warning('Could not connect to port: %s', port_error)
             connection_health['last_error'] = str(port_error)
             return False
 
@@ -100,41 +476,35 @@ def init_device():
 
         # Wait for initial data if needed
         if 'waitcomm' in pload.conf and pload.conf['waitcomm'] == '1':
-            print('Waiting for initial communication from device...', file=sys.stderr)
-            timeout = 10
-            start = time.time()
-            while not pload.instr.gotupdate():
-                if time.time() - start > timeout:
-                    print('Warning: Timeout waiting for device data', file=sys.stderr)
-                    break
-                time.sleep(0.05)
-                pload.instr.recvdata()
+            log.info('Waiting for initial communication from device...')
+            if not pload.instr.waitupdate(timeout=10):
+                log.warning('Timeout waiting for device data')
 
         # Detect if device is already running a test
         try:
             # Get device state to check if load is already on
-            device_state = pload.instr.cmd_readstate(energy=True, limits=True, temp=True, short=False)
+            device_state = pload.instr.cmd_readstate(**READSTATE_FULL)
             load_on = device_state.get('out', 0)
 
             if load_on == 1:
-                print('Device load is already ON - detecting as running test', file=sys.stderr)
+                log.info('Device load is already ON - detecting as running test')
                 test_state['running'] = True
-                test_state['start_time'] = time.time()  # Start timing from now
-                test_state['data_points'] = []  # Reset data points for this session
-                print('Test state synchronized with device state', file=sys.stderr)
+                test_state['start_time'] = time.monotonic()  # Start timing from now
+                replace_data_ring()  # New data points for this session
+                log.info('Test state synchronized with device state')
             else:
                 test_state['running'] = False
                 test_state['start_time'] = None
-                print('Device load is OFF - ready to start new test', file=sys.stderr)
+                log.info('Device load is OFF - ready to start new test')
 
         except Exception as e:
-            print(f'Warning: Could not detect device running state: {e}', file=sys.stderr)
+            log.warning('Could not detect device running state: %s', e)
             test_state['running'] = False
             test_state['start_time'] = None
 
         return True
     except Exception as e:
-        print(f'Error initializing device: {e}', file=sys.stderr)
+        log.error('Error initializing device: %s', e)
         import traceback
         traceback.print_exc()
         connection_health['is_connected'] = False
@@ -146,7 +516,7 @@ def reconnect_device():
     global pload, connection_health
 
     connection_health['reconnect_attempts'] += 1
-    print(f'🔄 Reconnect attempt #{connection_health["reconnect_attempts"]}', file=sys.stderr)
+    log.info('🔄 Reconnect attempt #%s', connection_health["reconnect_attempts"])
 
     try:
         # Close existing connection if any
@@ -163,12 +533,12 @@ def reconnect_device():
             if not os.path.exists(port_path):
                 connection_health['is_connected'] = False
                 connection_health['last_error'] = f'Serial port {port_path} not found'
-                print(f'❌ Serial port {port_path} not found', file=sys.stderr)
+                log.error('❌ Serial port %s not found', port_path)
                 return False
 
         # Reinitialize
         if init_device():
-            print(f'✅ Reconnection successful', file=sys.stderr)
+            log.info('✅ Reconnection successful')
             connection_health['reconnect_attempts'] = 0
             return True
         else:
@@ -177,31 +547,31 @@ def reconnect_device():
     except Exception as e:
         connection_health['is_connected'] = False
         connection_health['last_error'] = str(e)
-        print(f'❌ Reconnection failed: {e}', file=sys.stderr)
+        log.error('❌ Reconnection failed: %s', e)
         return False
 
-def manage_connection_health(success):
+def manage_connection_health(success, now=None):
     """Manage connection health and adaptive update intervals"""
     global connection_health, pload
 
-    current_time = time.time()
+    current_time = time.monotonic() if now is None else now
 
     if success:
         connection_health['last_successful_query'] = current_time
         connection_health['consecutive_failures'] = 0
         connection_health['is_connected'] = True
         connection_health['last_error'] = None
-        # Reduce update interval gradually on success
-        if connection_health['update_interval'] > 3.0:
-            connection_health['update_interval'] = max(3.0, connection_health['update_interval'] - 0.5)
+        # Back to the regular update interval as soon as the device answers again
+        connection_health['update_interval'] = connection_health['min_update_interval']
     else:
         connection_health['consecutive_failures'] += 1
-        print(f'⚠️ Connection failure #{connection_health["consecutive_failures"]}', file=sys.stderr)
+        log.warning('⚠️ Connection failure #%s', connection_health["consecutive_failures"])
 
-        # Increase update interval on failures
-        connection_health['update_interval'] = min(
-            connection_health['max_update_interval'],
-            connection_health['update_interval'] + 0.5
+        # Grow update interval on failures, jittered to spread out retries
+        connection_health['update_interval'] = backoff(
+            connection_health['update_interval'], connection_health['poll_backoff_base'],
+            connection_health['min_update_interval'],
+            connection_health['max_update_interval']
         )
 
         # Mark as disconnected after multiple failures
@@ -210,286 +580,414 @@ def manage_connection_health(success):
 
         # Attempt connection reset if too many failures
         if (connection_health['consecutive_failures'] >= connection_health['max_consecutive_failures'] and
-            current_time - connection_health['last_reset_time'] > connection_health['min_reset_interval']):
+            current_time - connection_health['last_reset_time'] > connection_health['reset_delay']):
 
-            print(f'🔄 Attempting automatic reconnection after {connection_health["consecutive_failures"]} failures', file=sys.stderr)
+            log.info('🔄 Attempting automatic reconnection after %s failures', connection_health["consecutive_failures"])
             connection_health['last_reset_time'] = current_time
 
             # Use reconnect_device for proper reconnection
             if reconnect_device():
                 connection_health['connection_reset_count'] += 1
-                print(f'✅ Auto-reconnection successful (reset #{connection_health["connection_reset_count"]})', file=sys.stderr)
+                connection_health['reset_delay'] = connection_health['min_reset_interval']
+                log.info('✅ Auto-reconnection successful (reset #%s)', connection_health["connection_reset_count"])
             else:
-                print(f'❌ Auto-reconnection failed', file=sys.stderr)
+                # Wait exponentially longer before the next reset attempt (doubling
+                # the current delay, so a long outage cannot overflow a shift count)
+                connection_health['reset_delay'] = backoff(
+                    connection_health['reset_delay'], 2,
+                    connection_health['min_reset_interval'],
+                    connection_health['max_reset_interval']
+                )
+                log.error('❌ Auto-reconnection failed, next attempt in %.0fs', connection_health["reset_delay"])
 
 def update_data():
-    """Background thread to continuously update device data"""
-    global test_state, pload
+    """Background thread owning the device: polls data and runs queued device jobs"""
+    global test_state, pload, device_snapshot, status_version
     last_log_time = 0
-    last_device_state = {}
+    last_logged_state = None  # fingerprint of the device state logged last
+    last_emit_key = None
+    last_emit_time = 0
+    last_reading = None  # (V, A, Ah, Wh, temp) behind the current_data dict we built last
+    last_reading_data = None
+    voltage_history = deque(maxlen=10)  # (time, voltage) of the running test for adaptive polling
+    idle_key = None  # (load, Iset, Vcut, ~V) while idle, a change there is a state change
+    idle_change_time = None
+    idle_changes = deque(maxlen=IDLE_CHANGE_HISTORY)  # seconds between idle state changes
+    idle_schedule = None
+    poll_interval = None
 
     while True:
-        if pload and pload.instr and pload.instr.comm:
+        device_state = None
+        # Reconnects replace instr.comm, but the instrument object itself stays
+        instr = pload.instr if pload else None
+        if instr and instr.comm:
             try:
-                with serial_lock:
-                    # Update data from device
-                    pload.instr.recvdata()
-
-                    # Get complete device state
-                    device_state = pload.instr.cmd_readstate(energy=True, limits=True, temp=True, short=False)
-                    load_on = device_state.get('out', 0)
-
-                    # Log state changes (every 30 seconds to avoid spam)
-                current_time = time.time()
-                if current_time - last_log_time > 30:
-                    if (device_state != last_device_state or
+                # Update data from device
+                instr.recvdata()
+
+                # Get complete device state and publish it for the API handlers
+                device_state = instr.cmd_readstate(**READSTATE_FULL)
+                device_snapshot = device_state
+            except Exception as e:
+                log.error('Error reading device: %s', e)
+                manage_connection_health(False)
+                poll_interval = None
+                # Add small delay on errors to prevent rapid-fire error attempts
+                time.sleep(0.5)
+
+        if device_state is not None:
+            try:
+                load_on = device_state.get('out', 0)
+                now = time.monotonic()  # one clock read for the whole tick
+
+                # Log state changes (every 30 seconds to avoid spam)
+                if now - last_log_time > 30 and log.isEnabledFor(logging.INFO):
+                    # All values are numbers (or None) in a fixed key order, so a hash
+                    # of them tells whether anything changed without keeping a copy
+                    state_fingerprint = hash(tuple(device_state.values()))
+                    if (state_fingerprint != last_logged_state or
                         test_state['running'] != (load_on == 1 and test_state['current_data'].get('current', 0) > 0.01)):
 
-                        print(f'=== DEVICE STATUS UPDATE ===', file=sys.stderr)
-                        print(f'Load status: {load_on} ({"ON" if load_on else "OFF"})', file=sys.stderr)
-                        print(f'Output voltage: {device_state.get("V", 0) or 0:.3f}V', file=sys.stderr)
-                        print(f'Output current: {device_state.get("A", 0) or 0:.3f}A', file=sys.stderr)
-                        print(f'Set current: {device_state.get("Iset", 0) or 0:.3f}A', file=sys.stderr)
-                        print(f'Capacity: {device_state.get("Ah", 0) or 0:.3f}Ah', file=sys.stderr)
-                        print(f'Energy: {device_state.get("Wh", 0) or 0:.3f}Wh', file=sys.stderr)
-                        print(f'Temperature: {device_state.get("temp", 0) or 0:.1f}°C', file=sys.stderr)
-                        print(f'Cutoff voltage: {device_state.get("Vcut", 0) or 0:.3f}V', file=sys.stderr)
-                        print(f'Test running: {test_state["running"]}', file=sys.stderr)
-
-                        last_device_state = device_state.copy()
-                        last_log_time = current_time
-                        print(f'=== END STATUS UPDATE ===', file=sys.stderr)
+                        log.info('\n'.join([
+                            '=== DEVICE STATUS UPDATE ===',
+                            'Load status: %s (%s)',
+                            'Output voltage: %.3fV',
+                            'Output current: %.3fA',
+                            'Set current: %.3fA',
+                            'Capacity: %.3fAh',
+                            'Energy: %.3fWh',
+                            'Temperature: %.1f°C',
+                            'Cutoff voltage: %.3fV',
+                            'Test running: %s',
+                            '=== END STATUS UPDATE ==='
+                        ]),
+                            load_on, 'ON' if load_on else 'OFF',
+                            device_state.get('V', 0) or 0,
+                            device_state.get('A', 0) or 0,
+                            device_state.get('Iset', 0) or 0,
+                            device_state.get('Ah', 0) or 0,
+                            device_state.get('Wh', 0) or 0,
+                            device_state.get('temp', 0) or 0,
+                            device_state.get('Vcut', 0) or 0,
+                            test_state['running'])
+
+                        last_logged_state = state_fingerprint
+                        last_log_time = now
 
                 # Enhanced communication error handling
-                device_state_str = str(device_state)
-                has_comm_errors = (
-                    'REPLY TIMEOUT' in device_state_str or
-                    'ERR:' in device_state_str or
-                    'device reports readiness to read but returned no data' in device_state_str or
-                    'cannot send command' in device_state_str
-                )
+                has_comm_errors = instr.queryerrs != 0
 
                 if has_comm_errors:
-                    print(f'⚠️ Communication issue detected - checking device responsiveness', file=sys.stderr)
+                    log.warning('⚠️ Communication issue detected - checking device responsiveness')
                     manage_connection_health(False)
 
-                    # Try to recover connection
-                    if pload and pload.instr and hasattr(pload.instr, 'comm') and pload.instr.comm:
+                    # Try to recover connection (comm is re-read, the health check may have reconnected)
+                    if instr.comm:
                         try:
-                            # Try to reset communication
-                            pload.instr.comm.flushInput()
-                            pload.instr.comm.flushOutput()
+                            # Try to reset communication: drop stale input and half-parsed packets
+                            instr.comm.recvflush()
+                            instr.clearbuf()
                             time.sleep(0.2)  # Slightly longer delay
-                            print(f'🔄 Communication reset attempted', file=sys.stderr)
+                            log.info('🔄 Communication reset attempted')
                         except Exception as reset_error:
-                            print(f'❌ Communication reset failed: {reset_error}', file=sys.stderr)
+                            log.error('❌ Communication reset failed: %s', reset_error)
 
                 # Synchronize test state with device state
                 # Only sync if we have valid data (no comm errors)
                 if not has_comm_errors:
                     # If device shows load ON but we think test is not running, update our state
                     if load_on == 1 and not test_state['running']:
-                        print(f'🔄 STATE SYNC: Device load turned ON - auto-detecting as running test', file=sys.stderr)
-                        print(f'   Load: ON, Current: {test_state["current_data"].get("current", 0):.3f}A', file=sys.stderr)
+                        log.info('🔄 STATE SYNC: Device load turned ON - auto-detecting as running test')
+                        log.info('   Load: ON, Current: %.3fA', test_state["current_data"].get("current", 0))
                         test_state['running'] = True
                         if not test_state['start_time']:
-                            test_state['start_time'] = time.time()
-                            test_state['data_points'] = []  # Reset for new session
-                            print(f'   Started new test session at {time.strftime("%H:%M:%S")}', file=sys.stderr)
+                            test_state['start_time'] = now
+                            replace_data_ring()  # New ring for the new session
+                            log.info('   Started new test session at %s', time.strftime("%H:%M:%S"))
                     # If device shows load OFF but we think test is running, update our state
                     elif load_on == 0 and test_state['running']:
-                        print(f'🔄 STATE SYNC: Device load turned OFF - auto-stopping test tracking', file=sys.stderr)
+                        log.info('🔄 STATE SYNC: Device load turned OFF - auto-stopping test tracking')
                         final_runtime = test_state['current_data'].get('runtime', 0)
                         final_capacity = test_state['current_data'].get('capacity', 0)
-                        print(f'   Test ended after {final_runtime:.1f}s, {final_capacity:.0f}mAh', file=sys.stderr)
+                        log.info('   Test ended after %.1fs, %.0fmAh', final_runtime, final_capacity)
                         test_state['running'] = False
                         test_state['start_time'] = None
 
-                # Use data from device_state (already fetched inside serial_lock)
-                # This avoids race conditions and duplicate serial queries
+                # Use data from device_state (already fetched above)
+                # This avoids duplicate serial queries
                 voltage = device_state.get('V', 0) or 0
                 current = device_state.get('A', 0) or 0
                 capacity = (device_state.get('Ah', 0) or 0) * 1000  # Convert to mAh
                 energy = (device_state.get('Wh', 0) or 0) * 1000    # Convert to mWh
                 temp = device_state.get('temp', 0) or 0
 
-                # Calculate resistance (R = V/I, avoid division by zero)
-                resistance = (voltage / current) if current > 0.001 else 0.0  # Ω, threshold 1mA
-
-                # Update current data
-                test_state['current_data'] = {
-                    'voltage': voltage,
-                    'current': current,
-                    'power': voltage * current,
-                    'resistance': resistance,
-                    'capacity': capacity,
-                    'energy': energy,
-                    'temperature': temp,
-                    'runtime': (time.time() - test_state['start_time']) if test_state['start_time'] else 0
-                }
-
-                # Emit WebSocket update
-                try:
-                    socketio.emit('status_update', {
-                        'connected': connection_health['is_connected'],
-                        'running': test_state['running'],
-                        'load_on': load_on,
-                        'cutoff_voltage': device_state.get('Vcut', 0.0),
-                        'set_current': device_state.get('Iset', 0.0),
-                        'data': test_state['current_data'],
-                        'connection_health': {
-                            'consecutive_failures': connection_health['consecutive_failures'],
-                            'last_error': connection_health['last_error'],
-                            'reconnect_attempts': connection_health['reconnect_attempts'],
-                            'update_interval': connection_health['update_interval']
-                        }
-                    })
-                except Exception as ws_error:
-                    pass  # WebSocket emit failures are non-critical
-
-                # If test is running, record data point
-                if test_state['running']:
-                    test_state['data_points'].append({
-                        'time': test_state['current_data']['runtime'],
-                        'timestamp': time.time(),  # Add Unix timestamp
-                        'datetime': time.strftime('%Y-%m-%d %H:%M:%S'),  # Add readable datetime string
+                runtime = (now - test_state['start_time']) if test_state['start_time'] else 0
+
+                # Update current data, only the runtime if the readings did not change
+                # (the dict is rebuilt if start_test replaced it meanwhile)
+                reading = (voltage, current, capacity, energy, temp)
+                if reading == last_reading and test_state['current_data'] is last_reading_data:
+                    last_reading_data['runtime'] = runtime
+                else:
+                    # Calculate resistance (R = V/I, avoid division by zero)
+                    resistance = (voltage / current) if current > 0.001 else 0.0  # Ω, threshold 1mA
+                    last_reading_data = test_state['current_data'] = {
                         'voltage': voltage,
                         'current': current,
-                        'capacity': capacity
-                    })
+                        'power': voltage * current,
+                        'resistance': resistance,
+                        'capacity': capacity,
+                        'energy': energy,
+                        'temperature': temp,
+                        'runtime': runtime
+                    }
+                    last_reading = reading
+
+                # Emit WebSocket update, skipping frames that carry no new information.
+                # The whole reading is in the key: during a steady discharge V/I stay
+                # put while capacity, energy and runtime (the chart's time axis) move.
+                emit_key = (
+                    connection_health['is_connected'], test_state['running'], load_on,
+                    reading, round(runtime, 1),
+                    device_state.get('Vcut', 0.0), device_state.get('Iset', 0.0),
+                    connection_health['consecutive_failures'], connection_health['last_error']
+                )
+                if emit_key != last_emit_key or now - last_emit_time >= STATUS_EMIT_KEEPALIVE:
+                    try:
+                        payload = status_payload
+                        payload['connected'] = connection_health['is_connected']
+                        payload['running'] = test_state['running']
+                        payload['load_on'] = load_on
+                        payload['cutoff_voltage'] = device_state.get('Vcut', 0.0)
+                        payload['set_current'] = device_state.get('Iset', 0.0)
+                        payload['data'] = test_state['current_data']
+                        health = payload['connection_health']
+                        health['consecutive_failures'] = connection_health['consecutive_failures']
+                        health['last_error'] = connection_health['last_error']
+                        health['reconnect_attempts'] = connection_health['reconnect_attempts']
+                        health['update_interval'] = connection_health['update_interval']
+                        status_version += 1
+                        socketio.emit('status_update', payload)
+                        publish_stream(payload)
+                        last_emit_key = emit_key
+                        last_emit_time = now
+                    except Exception as ws_error:
+                        pass  # WebSocket emit failures are non-critical
+
+                # Place polls by the expected time to cutoff while discharging, and
+                # by the observed times between state changes while idle
+                poll_interval = None
+                if test_state['running'] and load_on == 1 and not has_comm_errors:
+                    voltage_history.append((now, voltage))
+                    poll_interval = adaptive_poll_interval(voltage_history, device_state.get('Vcut', 0) or 0)
+                else:
+                    voltage_history.clear()
+                if not test_state['running'] and not has_comm_errors:
+                    key = (load_on, device_state.get('Iset'), device_state.get('Vcut'), round(voltage, 1))
+                    if key != idle_key:
+                        if idle_change_time is not None:
+                            idle_changes.append(now - idle_change_time)
+                            idle_schedule = idle_poll_schedule(idle_changes)
+                        idle_key = key
+                        idle_change_time = now
+                    if idle_schedule:
+                        poll_interval = idle_poll_interval(idle_schedule, now - idle_change_time)
+                else:
+                    idle_key = None  # the test changes the state, start over once idle again
+                    idle_change_time = None
 
-                    # Successful data update - manage connection health
-                    manage_connection_health(True)
+                # If test is running, record data point
+                if test_state['running']:
+                    samples = monitor_samples
+                    if samples is not None and not has_comm_errors:
+                        try:
+                            samples.put_nowait((voltage, current))
+                        except queue.Full:
+                            pass  # Monitor is stuck, it goes by the latest samples anyway
+                    test_state['data_points'].append(
+                        test_state['current_data']['runtime'],
+                        time.time(),  # Unix timestamp, clients format it as needed
+                        voltage,
+                        current,
+                        capacity
+                    )
+
+                # Successful data update - manage connection health
+                if not has_comm_errors:
+                    manage_connection_health(True, now)
 
             except Exception as e:
-                print(f'Error updating data: {e}', file=sys.stderr)
-                manage_connection_health(False)
-                # Add small delay on errors to prevent rapid-fire error attempts
-                time.sleep(0.5)
-
-        # Use adaptive update interval based on connection health
-        time.sleep(connection_health['update_interval'])
-
-def test_monitor(cutoff_voltage, max_time):
-    """Monitor test and stop when conditions are met"""
-    global test_state, pload
-
-    start_time = time.time()
+                # Not a device failure: keep the health counters and poll on schedule
+                log.error('Error processing device data: %s', e)
+                poll_interval = None
+
+        # Use adaptive update interval based on connection health (or on the
+        # discharge curve while it is healthy), serving device jobs while waiting
+        if poll_interval is None or connection_health['consecutive_failures'] > 0:
+            poll_interval = connection_health['update_interval']
+        publish_state()
+        if run_device_jobs(poll_interval):
+            publish_state()  # jobs may have changed the state, don't wait for the next poll
+
+def test_monitor(cutoff_voltage, max_time, samples):
+    """Monitor test and stop when conditions are met
+
+    samples is the queue update_data puts (voltage, current) into on every poll.
+    """
+    global test_state, pload, monitor_samples
+
+    start_time = time.monotonic()
     last_status_log = 0
-    voltage_samples = []
-    current_samples = []
+    # Keep only last 60 samples (1 minute at 1s interval)
+    voltage_samples = deque(maxlen=60)
+    # Last 10 (voltage, current) samples with running sums for the averages
+    recent_samples = deque(maxlen=10)
+    recent_vsum = 0.0
+    recent_isum = 0.0
 
-    print(f'=== TEST MONITOR STARTED ===', file=sys.stderr)
-    print(f'Monitoring cutoff: {cutoff_voltage}V, Max time: {max_time}s', file=sys.stderr)
-    print(f'Monitoring started at: {time.strftime("%H:%M:%S")}', file=sys.stderr)
+    log.info('=== TEST MONITOR STARTED ===')
+    log.info('Monitoring cutoff: %sV, Max time: %ss', cutoff_voltage, max_time)
+    log.info('Monitoring started at: %s', time.strftime("%H:%M:%S"))
 
     # Wait a moment for data to stabilize after reset
     time.sleep(1)
 
+    current_voltage = test_state['current_data']['voltage']
     while test_state['running']:
-        current_voltage = test_state['current_data']['voltage']
-        current_current = test_state['current_data']['current']
-        elapsed_time = time.time() - start_time
+        # Wait for the next poll; the timeout keeps the time limit and
+        # heartbeat checks going while polls are stalled
+        try:
+            current_voltage, current_current = samples.get(timeout=1.0)
+            fresh = True
+        except queue.Empty:
+            fresh = False
+        now = time.monotonic()
+        elapsed_time = now - start_time
 
         # Collect samples for trend analysis
-        voltage_samples.append(current_voltage)
-        current_samples.append(current_current)
-
-        # Keep only last 60 samples (1 minute at 1s interval)
-        if len(voltage_samples) > 60:
-            voltage_samples.pop(0)
-            current_samples.pop(0)
+        if fresh:
+            voltage_samples.append(current_voltage)
+            if len(recent_samples) == recent_samples.maxlen:
+                old_voltage, old_current = recent_samples[0]
+                recent_vsum -= old_voltage
+                recent_isum -= old_current
+            recent_samples.append((current_voltage, current_current))
+            recent_vsum += current_voltage
+            recent_isum += current_current
 
         # Log status every 30 seconds or when significant changes occur
-        current_time = time.time()
-        if current_time - last_status_log > 30:
-            if len(voltage_samples) >= 10:
-                avg_voltage = sum(voltage_samples[-10:]) / 10
-                avg_current = sum(current_samples[-10:]) / 10
+        if now - last_status_log > 30 and log.isEnabledFor(logging.INFO):
+            if len(recent_samples) >= 10:
+                avg_voltage = recent_vsum / len(recent_samples)
+                avg_current = recent_isum / len(recent_samples)
                 voltage_trend = voltage_samples[-1] - voltage_samples[0] if len(voltage_samples) > 1 else 0
 
-                print(f'📊 TEST STATUS (t+{elapsed_time:.0f}s):', file=sys.stderr)
-                print(f'   V: {avg_voltage:.3f}V (trend: {voltage_trend:+.3f}V)', file=sys.stderr)
-                print(f'   I: {avg_current:.3f}A', file=sys.stderr)
-                print(f'   Capacity: {test_state["current_data"]["capacity"]:.0f}mAh', file=sys.stderr)
-                print(f'   Energy: {test_state["current_data"]["energy"]:.0f}mWh', file=sys.stderr)
-                print(f'   Resistance: {test_state["current_data"]["resistance"]:.3f}Ω', file=sys.stderr)
-
-                last_status_log = current_time
+                log.info('\n'.join([
+                    '📊 TEST STATUS (t+%.0fs):',
+                    '   V: %.3fV (trend: %+.3fV)',
+                    '   I: %.3fA',
+                    '   Capacity: %.0fmAh',
+                    '   Energy: %.0fmWh',
+                    '   Resistance: %.3fΩ'
+                ]),
+                    elapsed_time,
+                    avg_voltage, voltage_trend,
+                    avg_current,
+                    test_state['current_data']['capacity'],
+                    test_state['current_data']['energy'],
+                    test_state['current_data']['resistance'])
+
+                last_status_log = now
 
         # Only check cutoff if we have valid voltage data (> 1V)
         if current_voltage > 1.0:
             # Check cutoff conditions
-            if current_voltage <= cutoff_voltage:
-                print(f'🛑 CUTOFF REACHED: {current_voltage:.3f}V <= {cutoff_voltage}V', file=sys.stderr)
-                print(f'   Test duration: {elapsed_time:.1f}s', file=sys.stderr)
-                print(f'   Final capacity: {test_state["current_data"]["capacity"]:.0f}mAh', file=sys.stderr)
-                print(f'   Final energy: {test_state["current_data"]["energy"]:.0f}mWh', file=sys.stderr)
+            if fresh and current_voltage <= cutoff_voltage:
+                log.info('🛑 CUTOFF REACHED: %.3fV <= %sV', current_voltage, cutoff_voltage)
+                log.info('   Test duration: %.1fs', elapsed_time)
+                log.info('   Final capacity: %.0fmAh', test_state["current_data"]["capacity"])
+                log.info('   Final energy: %.0fmWh', test_state["current_data"]["energy"])
                 stop_test_internal()
                 break
 
             if max_time > 0 and elapsed_time >= max_time:
-                print(f'⏰ TIME LIMIT REACHED: {elapsed_time:.1f}s >= {max_time}s', file=sys.stderr)
-                print(f'   Final voltage: {current_voltage:.3f}V', file=sys.stderr)
-                print(f'   Final capacity: {test_state["current_data"]["capacity"]:.0f}mAh', file=sys.stderr)
-                print(f'   Final energy: {test_state["current_data"]["energy"]:.0f}mWh', file=sys.stderr)
+                log.info('⏰ TIME LIMIT REACHED: %.1fs >= %ss', elapsed_time, max_time)
+                log.info('   Final voltage: %.3fV', current_voltage)
+                log.info('   Final capacity: %.0fmAh', test_state["current_data"]["capacity"])
+                log.info('   Final energy: %.0fmWh', test_state["current_data"]["energy"])
                 stop_test_internal()
                 break
 
             # Check heartbeat timeout (browser closed)
-            if last_heartbeat > 0 and time.time() - last_heartbeat > HEARTBEAT_TIMEOUT:
-                print(f'🔌 HEARTBEAT TIMEOUT: No browser connection for {HEARTBEAT_TIMEOUT}s', file=sys.stderr)
-                print(f'   Auto-stopping test for safety', file=sys.stderr)
-                print(f'   Final voltage: {current_voltage:.3f}V', file=sys.stderr)
-                print(f'   Final capacity: {test_state["current_data"]["capacity"]:.0f}mAh', file=sys.stderr)
+            if last_heartbeat > 0 and now - last_heartbeat > HEARTBEAT_TIMEOUT:
+                log.warning('🔌 HEARTBEAT TIMEOUT: No browser connection for %ss', HEARTBEAT_TIMEOUT)
+                log.info('   Auto-stopping test for safety')
+                log.info('   Final voltage: %.3fV', current_voltage)
+                log.info('   Final capacity: %.0fmAh', test_state["current_data"]["capacity"])
                 stop_test_internal()
                 break
 
             # Warn if voltage is approaching cutoff
-            if current_voltage <= cutoff_voltage + 0.2:
-                print(f'⚠️ LOW VOLTAGE WARNING: {current_voltage:.3f}V (cutoff: {cutoff_voltage}V)', file=sys.stderr)
+            if fresh and current_voltage <= cutoff_voltage + 0.2:
+                log.warning('⚠️ LOW VOLTAGE WARNING: %.3fV (cutoff: %sV)', current_voltage, cutoff_voltage)
 
-        time.sleep(1)
+    if monitor_samples is samples:
+        monitor_samples = None
+    log.info('=== TEST MONITOR ENDED ===')
 
-    print(f'=== TEST MONITOR ENDED ===', file=sys.stderr)
-
-def stop_test_internal():
+def stop_test_internal(final_state=None):
     """Internal function to stop test (called from monitor thread)"""
     global test_state, pload
 
-    print(f'⏹️ EXECUTING TEST STOP...', file=sys.stderr)
+    log.info('⏹️ EXECUTING TEST STOP...')
 
     if pload and pload.instr and pload.instr.comm:
         try:
-            # Read final values before turning off
-            final_voltage = pload.instr.cmd_getvolt()
-            final_current = pload.instr.cmd_getamp()
-            final_capacity = pload.instr.cmd_getah(div=1)
-            final_energy = pload.instr.cmd_getwh(div=1)
-
-            print(f'Sending command: Turn load OFF', file=sys.stderr)
-            pload.instr.cmd_setonoff(0)
-
-            # Verify load is actually off
-            time.sleep(0.2)
-            load_status = pload.instr.cmd_getonoff()
-            print(f'✓ Load turned OFF, status: {load_status} (0=OFF)', file=sys.stderr)
-
-            print(f'📋 FINAL TEST SUMMARY:', file=sys.stderr)
-            print(f'   Final voltage: {final_voltage:.3f}V', file=sys.stderr)
-            print(f'   Final current: {final_current:.3f}A', file=sys.stderr)
-            print(f'   Total capacity: {final_capacity:.0f}mAh', file=sys.stderr)
-            print(f'   Total energy: {final_energy:.0f}mWh', file=sys.stderr)
-            print(f'   Test duration: {test_state["current_data"].get("runtime", 0):.1f}s', file=sys.stderr)
-
+            device_call(switch_off_load, final_state)
         except Exception as e:
-            print(f'✗ Error stopping test: {e}', file=sys.stderr)
+            log.error('✗ Error stopping test: %s', e)
     else:
-        print(f'✗ Device not available for stopping test', file=sys.stderr)
+        log.error('✗ Device not available for stopping test')
 
     test_state['running'] = False
     test_state['start_time'] = None  # Reset start time to stop runtime calculation
-    print(f'✓ Test state cleared', file=sys.stderr)
+    log.info('✓ Test state cleared')
+
+def switch_off_load(final_state=None):
+    """Turn the load off and print the test summary
+
+    final_state is a cmd_readstate() result read just before, if the caller
+    has one; otherwise the final values are read here in a single pass.
+    """
+    # Read final values before turning off
+    if final_state is None:
+        final_state = pload.instr.cmd_readstate(energy=True, limits=False, temp=False, short=False)
+    final_voltage = final_state.get('V', 0) or 0
+    final_current = final_state.get('A', 0) or 0
+    final_capacity = (final_state.get('Ah', 0) or 0) * 1000  # Convert to mAh
+    final_energy = (final_state.get('Wh', 0) or 0) * 1000    # Convert to mWh
+
+    log.info('Sending command: Turn load OFF')
+    pload.instr.cmd_setonoff(0)
+
+    # Verify load is actually off
+    time.sleep(0.2)
+    load_status = pload.instr.cmd_getonoff()
+    log.info('✓ Load turned OFF, status: %s (0=OFF)', load_status)
+
+    log.info('\n'.join([
+        '📋 FINAL TEST SUMMARY:',
+        '   Final voltage: %.3fV',
+        '   Final current: %.3fA',
+        '   Total capacity: %.0fmAh',
+        '   Total energy: %.0fmWh',
+        '   Test duration: %.1fs'
+    ]),
+        final_voltage,
+        final_current,
+        final_capacity,
+        final_energy,
+        test_state['current_data'].get('runtime', 0))
 
 @app.route('/')
 def index():
@@ -499,30 +997,47 @@ def index():
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get current device status"""
-    device_state = {}
-
-    if pload and pload.instr and pload.instr.comm:
-        try:
-            with serial_lock:
-                # Get complete device state using cmd_readstate()
-                device_state = pload.instr.cmd_readstate(energy=True, limits=True, temp=True, short=False)
-        except Exception as e:
-            print(f'Error getting device status: {e}', file=sys.stderr)
-            connection_health['last_error'] = str(e)
-
-    return jsonify({
-        'connected': connection_health['is_connected'],
-        'running': test_state['running'],
+    # Served from the last poll of update_data, no serial I/O here
+    snap = state_snapshot
+    etag = f'{snap["version"]}-{int(snap["running"])}-{int(snap["connected"])}'
+    response = not_modified(etag)
+    if response:
+        return response
+    device_state = snap['device']
+
+    response = jsonify({
+        'connected': snap['connected'],
+        'running': snap['running'],
         'load_on': device_state.get('out', 0),
         'cutoff_voltage': device_state.get('Vcut', 0.0),
         'set_current': device_state.get('Iset', 0.0),
-        'data': test_state['current_data'],
-        'connection_health': {
-            'consecutive_failures': connection_health['consecutive_failures'],
-            'last_error': connection_health['last_error'],
-            'reconnect_attempts': connection_health['reconnect_attempts'],
-            'update_interval': connection_health['update_interval']
-        }
+        'data': snap['data'],
+        'connection_health': snap['health']
+    })
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/stream', methods=['GET'])
+def stream_status():
+    """Push the status_update frames as Server-Sent Events"""
+    subscriber = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    with stream_lock:
+        stream_subscribers.add(subscriber)
+
+    def generate():
+        try:
+            while True:
+                try:
+                    yield subscriber.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'  # also notices clients that went away
+        finally:
+            with stream_lock:
+                stream_subscribers.discard(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
     })
 
 @app.route('/api/reconnect', methods=['POST'])
@@ -536,9 +1051,10 @@ def api_reconnect():
             'error': 'Cannot reconnect while test is running'
         }), 400
 
-    print('📡 Manual reconnection requested', file=sys.stderr)
+    log.info('📡 Manual reconnection requested')
 
-    if reconnect_device():
+    if device_call(reconnect_device):
+        wake_updater()
         return jsonify({
             'success': True,
             'message': 'Reconnection successful'
@@ -549,10 +1065,45 @@ def api_reconnect():
             'error': connection_health['last_error'] or 'Reconnection failed'
         }), 500
 
+def configure_test(current, cutoff_voltage):
+    """Reset counters, set current and cutoff, then turn the load on"""
+    # Reset device energy counters before starting new test
+    try:
+        pload.instr.cmd_resetcounters()
+        log.info('✓ Counters reset')
+        time.sleep(0.3)
+    except Exception as e:
+        log.error('✗ Error resetting counters: %s', e)
+
+    # Set current
+    try:
+        pload.instr.cmd_setcurrent(current)
+        log.info('✓ Current set to %sA', current)
+        time.sleep(0.3)
+    except Exception as e:
+        log.error('✗ Error setting current: %s', e)
+
+    # Set cutoff voltage
+    try:
+        pload.instr.cmd_setcutoff(cutoff_voltage)
+        log.info('✓ Cutoff set to %sV', cutoff_voltage)
+        time.sleep(0.3)
+    except Exception as e:
+        log.error('✗ Error setting cutoff: %s', e)
+
+    # Turn on load
+    try:
+        pload.instr.cmd_setonoff(1)
+        log.info('✓ Load turned ON')
+        time.sleep(1.0)  # Wait for device to stabilize
+    except Exception as e:
+        log.error('✗ Error turning on load: %s', e)
+        raise e
+
 @app.route('/api/start', methods=['POST'])
 def start_test():
     """Start a discharge test"""
-    global test_state, pload, test_thread
+    global test_state, pload, test_thread, monitor_samples
 
     if test_state['running']:
         return jsonify({'success': False, 'error': 'Test already running'}), 400
@@ -560,56 +1111,41 @@ def start_test():
     if not pload or not pload.instr or not pload.instr.comm:
         return jsonify({'success': False, 'error': 'Device not connected'}), 400
 
-    data = request.json
-    current = float(data.get('current', 1.0))
-    cutoff_voltage = float(data.get('cutoff', 3.0))
-    max_time = int(data.get('maxTime', 0))  # in seconds
-
+    data = request.json or {}
     try:
-        print(f'=== STARTING BATTERY TEST ===', file=sys.stderr)
-        print(f'Test Parameters: Current={current}A, Cutoff={cutoff_voltage}V, MaxTime={max_time}s', file=sys.stderr)
-
-        # Reset device energy counters before starting new test
-        try:
-            pload.instr.cmd_resetcounters()
-            print(f'✓ Counters reset', file=sys.stderr)
-            time.sleep(0.3)
-        except Exception as e:
-            print(f'✗ Error resetting counters: {e}', file=sys.stderr)
-
-        # Set current
-        try:
-            pload.instr.cmd_setcurrent(current)
-            print(f'✓ Current set to {current}A', file=sys.stderr)
-            time.sleep(0.3)
-        except Exception as e:
-            print(f'✗ Error setting current: {e}', file=sys.stderr)
-
-        # Set cutoff voltage
-        try:
-            pload.instr.cmd_setcutoff(cutoff_voltage)
-            print(f'✓ Cutoff set to {cutoff_voltage}V', file=sys.stderr)
-            time.sleep(0.3)
-        except Exception as e:
-            print(f'✗ Error setting cutoff: {e}', file=sys.stderr)
+        current = float(data.get('current', 1.0))
+        cutoff_voltage = float(data.get('cutoff', 3.0))
+        max_time = int(data.get('maxTime', 0))  # in seconds
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f'Invalid test parameters: {e}'}), 400
+    if not 0 <= max_time <= MAX_TEST_TIME:
+        return jsonify({'success': False, 'error': f'maxTime must be between 0 and {MAX_TEST_TIME}s'}), 400
+
+    ring = None
+    try:
+        log.info('=== STARTING BATTERY TEST ===')
+        log.info('Test Parameters: Current=%sA, Cutoff=%sV, MaxTime=%ss', current, cutoff_voltage, max_time)
+
+        # Size the sample buffer for the whole test if it has a time limit. Polls
+        # speed up to MIN_POLL_INTERVAL near cutoff, so size for that rate,
+        # never for the interval of the moment: the ring wraps silently.
+        # Allocated before the load is switched on, so a failure leaves it off.
+        if max_time > 0:
+            ring = new_data_ring(max(DATA_RING_SIZE, int(max_time / MIN_POLL_INTERVAL) + 16))
+        else:
+            ring = new_data_ring()
 
-        # Turn on load
-        try:
-            pload.instr.cmd_setonoff(1)
-            print(f'✓ Load turned ON', file=sys.stderr)
-            time.sleep(1.0)  # Wait for device to stabilize
-        except Exception as e:
-            print(f'✗ Error turning on load: {e}', file=sys.stderr)
-            raise e
+        device_call(configure_test, current, cutoff_voltage)
 
-        print(f'=== DEVICE CONFIGURATION COMPLETE ===', file=sys.stderr)
+        log.info('=== DEVICE CONFIGURATION COMPLETE ===')
 
         # Initialize test state - reset all values
         global last_heartbeat
-        last_heartbeat = time.time()  # Initialize heartbeat for timeout check
+        last_heartbeat = time.monotonic()  # Initialize heartbeat for timeout check
         test_state['running'] = True
-        test_state['start_time'] = time.time()
-        test_state['data_points'] = []
+        test_state['start_time'] = time.monotonic()
+        replace_data_ring(ring)
+        ring = None  # recording into it now
         test_state['current_data'] = {
             'voltage': 0.0,
             'current': 0.0,
@@ -621,9 +1157,11 @@ def start_test():
             'runtime': 0
         }
 
-        # Start monitoring thread
-        test_thread = threading.Thread(target=test_monitor, args=(cutoff_voltage, max_time), daemon=True)
+        # Start monitoring thread, fed by update_data through monitor_samples
+        monitor_samples = queue.Queue(maxsize=MONITOR_QUEUE_SIZE)
+        test_thread = threading.Thread(target=test_monitor, args=(cutoff_voltage, max_time, monitor_samples), daemon=True)
         test_thread.start()
+        wake_updater()
 
         return jsonify({
             'success': True,
@@ -631,6 +1169,17 @@ def start_test():
         })
 
     except Exception as e:
+        log.error('❌ Error starting test: %s', e)
+        # Do not leave a half-started test discharging without a monitor
+        test_state['running'] = False
+        test_state['start_time'] = None
+        monitor_samples = None
+        if ring is not None:
+            ring.discard()
+        try:
+            device_call(pload.instr.cmd_setonoff, 0)
+        except Exception as off_error:
+            log.error('❌ Could not switch the load off: %s', off_error)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/stop', methods=['POST'])
@@ -642,35 +1191,101 @@ def stop_test():
         return jsonify({'success': True, 'message': 'No test running (already stopped)'})
 
     try:
-        print(f'=== STOPPING BATTERY TEST ===', file=sys.stderr)
+        log.info('=== STOPPING BATTERY TEST ===')
 
         # Read final device state before stopping
+        final_state = None
         try:
-            final_state = pload.instr.cmd_readstate(energy=True, limits=True, temp=True, short=False)
-            final_voltage = pload.instr.cmd_getvolt()
-            final_current = pload.instr.cmd_getamp()
-            final_capacity = pload.instr.cmd_getah(div=1)
-            final_energy = pload.instr.cmd_getwh(div=1)
-
-            print(f'Final measurements: V={final_voltage:.3f}V, I={final_current:.3f}A, Capacity={final_capacity:.0f}mAh, Energy={final_energy:.0f}mWh', file=sys.stderr)
-            print(f'Final device state: Load={final_state.get("out", 0)}, SetCurrent={final_state.get("Iset", 0)}A, Cutoff={final_state.get("Vcut", 0)}V', file=sys.stderr)
+            final_state = device_call(pload.instr.cmd_readstate, **READSTATE_FULL)
+            final_voltage = final_state.get('V', 0) or 0
+            final_current = final_state.get('A', 0) or 0
+            final_capacity = (final_state.get('Ah', 0) or 0) * 1000  # Convert to mAh
+            final_energy = (final_state.get('Wh', 0) or 0) * 1000    # Convert to mWh
+
+            log.info('Final measurements: V=%.3fV, I=%.3fA, Capacity=%.0fmAh, Energy=%.0fmWh', final_voltage, final_current, final_capacity, final_energy)
+            log.info('Final device state: Load=%s, SetCurrent=%sA, Cutoff=%sV', final_state.get("out", 0), final_state.get("Iset", 0), final_state.get("Vcut", 0))
         except Exception as e:
-            print(f'Warning: Could not read final device state: {e}', file=sys.stderr)
+            log.warning('Could not read final device state: %s', e)
 
-        stop_test_internal()
+        stop_test_internal(final_state)
+        wake_updater()
 
-        print(f'=== TEST STOPPED ===', file=sys.stderr)
+        log.info('=== TEST STOPPED ===')
         return jsonify({'success': True, 'message': 'Test stopped'})
     except Exception as e:
-        print(f'✗ Error stopping test: {e}', file=sys.stderr)
+        log.error('✗ Error stopping test: %s', e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/data', methods=['GET'])
 def get_data():
-    """Get all recorded data points"""
+    """Get all recorded data points
+
+    ?format=columns returns one list per column instead of a dict per sample,
+    ?format=binary returns the columns as raw float64 values, one after another.
+    """
+    data_points = test_state['data_points']
+    response = not_modified(data_points.etag())
+    if response:
+        return response
+    # One copy for the whole response: count, columns and ETag all match it
+    written, columns = data_points.snapshot()
+    count = len(columns[0])
+    data_format = request.args.get('format', '')
+    if data_format == 'columns':
+        response = jsonify({
+            'columns': data_points.to_columns(columns),
+            'count': count
+        })
+    elif data_format == 'binary':
+        response = Response(data_points.to_bytes(columns), mimetype='application/octet-stream', headers={
+            'X-Data-Columns': ','.join(data_points.COLUMNS),
+            'X-Data-Count': str(count)
+        })
+    else:
+        response = jsonify({
+            'dataPoints': data_points.to_list(columns),
+            'count': count
+        })
+    response.set_etag(f'{data_points.generation}-{written}')
+    return response
+
+@app.route('/api/data.csv', methods=['GET'])
+def get_data_csv():
+    """Download all recorded data points as CSV, streamed in chunks"""
+    data_points = test_state['data_points']
+    # A copy cut at one written count, so the update thread can keep recording meanwhile
+    _, columns = data_points.snapshot()
+
+    def generate():
+        format_row = data_points.CSV_ROW.format
+        chunk = [','.join(data_points.COLUMNS) + '\n']
+        size = 0
+        for values in zip(*columns):
+            line = format_row(*values)
+            chunk.append(line)
+            size += len(line)
+            if size >= CSV_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        yield ''.join(chunk)
+
+    return Response(generate(), mimetype='text/csv', headers={
+        'Content-Disposition': 'attachment; filename=dl24_data.csv'
+    })
+
+@app.route('/api/shm', methods=['GET'])
+def get_shm():
+    """Describe the shared memory block holding the recorded samples"""
+    data_points = test_state['data_points']
+    if not isinstance(data_points, SharedDataRing):
+        return jsonify({'success': False, 'error': 'Shared memory disabled, start with DL24_SHM=1'}), 404
     return jsonify({
-        'dataPoints': test_state['data_points'],
-        'count': len(test_state['data_points'])
+        'success': True,
+        'name': data_points.shm.name,
+        'size': data_points.size,
+        'header': ['size', 'written', 'generation'],
+        'columns': list(data_points.COLUMNS)
     })
 
 @app.route('/api/reset', methods=['POST'])
@@ -682,7 +1297,7 @@ def reset_counters():
         return jsonify({'success': False, 'error': 'Device not connected'}), 400
 
     try:
-        pload.instr.cmd_resetcounters()
+        device_call(pload.instr.cmd_resetcounters)
         return jsonify({'success': True, 'message': 'Counters reset'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -691,72 +1306,157 @@ def reset_counters():
 def heartbeat():
     """Heartbeat from browser to prevent auto-stop"""
     global last_heartbeat
-    last_heartbeat = time.time()
+    last_heartbeat = time.monotonic()
     return jsonify({'success': True})
 
 @app.route('/api/config', methods=['GET'])
 def get_config():
-    """Get current device configuration"""
+    """Get current device configuration
+
+    Served from the last poll of update_data; ?fresh=1 reads it from the device.
+    """
     global pload
 
     if not pload or not pload.instr or not pload.instr.comm:
         return jsonify({'success': False, 'error': 'Device not connected'}), 400
 
     try:
-        return jsonify({
-            'success': True,
-            'config': {
+        device_state = state_snapshot['device']
+        if device_state and request.args.get('fresh') != '1':
+            config = {
+                'setCurrent': device_state.get('Iset'),
+                'setCutoff': device_state.get('Vcut'),
+                'outputEnabled': device_state.get('out')
+            }
+        else:
+            config = device_call(lambda: {
                 'setCurrent': pload.instr.cmd_getsetcurrent(),
                 'setCutoff': pload.instr.cmd_getsetcutoff(),
                 'outputEnabled': pload.instr.cmd_getonoff()
-            }
+            })
+        return jsonify({
+            'success': True,
+            'config': config
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Port enumeration can take seconds (e.g. with Bluetooth serial ports), so
+# results are reused for a few seconds
+PORTS_CACHE_TTL = 3.0
+ports_cache = {'time': 0.0, 'ports': None}
+ports_lock = threading.Lock()
+# Built-in UART names that are listed whether or not there is hardware behind them
+ONBOARD_TTY = re.compile(r'/dev/ttyS\d+$')
+
+def scan_serial_ports():
+    """Return the available serial ports, rescanning at most every PORTS_CACHE_TTL seconds"""
+    with ports_lock:  # concurrent requests wait for one scan instead of starting their own
+        now = time.monotonic()
+        if ports_cache['ports'] is not None and now - ports_cache['time'] < PORTS_CACHE_TTL:
+            return ports_cache['ports']
+
+        ports = []
+        # List all available serial ports, filtering out virtual/unused ttyS ports.
+        # No narrower list_ports.grep() here: it scans all ports anyway and
+        # would drop the Bluetooth /dev/rfcomm* ports the DL24 is often on.
+        is_onboard_tty = ONBOARD_TTY.match
+        for port in list_ports.comports():
+            # Skip ttyS ports without real hardware (no USB VID:PID)
+            if is_onboard_tty(port.device) and 'VID:PID' not in port.hwid:
+                continue
+            ports.append({
+                'device': port.device,
+                'description': port.description,
+                'hwid': port.hwid
+            })
+        ports_cache['ports'] = ports
+        ports_cache['time'] = time.monotonic()
+        return ports
+
+def invalidate_ports_cache():
+    """Make the next scan_serial_ports() call rescan"""
+    with ports_lock:
+        ports_cache['ports'] = None
+
 @app.route('/api/ports', methods=['GET'])
 def list_serial_ports():
     """List available serial ports"""
-    ports = []
-
-    if list_ports is None:
+    if load_list_ports() is None:
         return jsonify({
             'success': False,
             'error': 'pyserial not installed or list_ports unavailable'
         }), 500
 
     try:
-        # List all available serial ports, filtering out virtual/unused ttyS ports
-        for port in list_ports.comports():
-            # Skip ttyS ports without real hardware (no USB VID:PID)
-            if port.device.startswith('/dev/ttyS') and 'VID:PID' not in port.hwid:
-                continue
-            ports.append({
-                'device': port.device,
-                'description': port.description,
-                'hwid': port.hwid
-            })
+        ports = scan_serial_ports()
 
         # Get current port from config
-        current_port = pload.conf.get('serport', '') if pload else ''
-        current_host = pload.conf.get('host', '') if pload else ''
-        current_tcp_port = pload.conf.get('port', '') if pload else ''
+        snap = state_snapshot
 
         return jsonify({
             'success': True,
             'ports': ports,
             'current': {
-                'serport': current_port,
-                'host': current_host,
-                'port': current_tcp_port
+                'serport': snap['serport'],
+                'host': snap['host'],
+                'port': snap['port']
             }
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Serializes rewrites of ~/.dl24.cfg within this process, flock() on a side
+# file covers other processes (the config itself is replaced, not rewritten)
+config_lock = threading.Lock()
+# A serport line as PowerLoad.readconf() sees it: 'key = value', lines with '#' ignored
+SERPORT_LINE = re.compile(r'^(?![^\n]*#)[ \t]*serport[ \t]*=[^\n]*$', re.M)
+
+def update_config_serport(config_path, new_port):
+    """Set serport= in the config file, adding it if missing
+
+    The new content goes to a temporary file that then replaces the config,
+    so readers see either the old or the new file, never a partial one.
+    """
+    config_path = os.path.realpath(config_path)  # keep a symlinked config a symlink
+    with config_lock, open(config_path + '.lock', 'a') as lock:
+        if fcntl:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)  # released when the file is closed
+
+        try:
+            with open(config_path, 'r') as f:
+                text = f.read()
+            mode = os.stat(config_path).st_mode & 0o7777
+        except FileNotFoundError:
+            text = ''
+            mode = None
+
+        text, replaced = SERPORT_LINE.subn(lambda m: f'serport={new_port}', text)
+        # If serport wasn't in config, add it
+        if not replaced:
+            if text and not text.endswith('\n'):
+                text += '\n'
+            text += f'serport={new_port}\n'
+
+        # Write updated config
+        tmp_path = config_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, config_path)
+
+# Held for the whole port change, a second request meanwhile gets a 429
+port_change_lock = threading.Lock()
+
 @app.route('/api/set_port', methods=['POST'])
 def set_serial_port():
-    """Change serial port and reconnect"""
+    """Change serial port and reconnect
+
+    Answers 202 right away; the result follows as a 'port_status' WebSocket event.
+    """
     global pload, test_state
 
     data = request.json
@@ -772,62 +1472,88 @@ def set_serial_port():
             'error': 'Cannot change port while test is running'
         }), 400
 
+    if not port_change_lock.acquire(blocking=False):
+        return jsonify({'success': False, 'error': 'Port change already in progress'}), 429
     try:
-        print(f'=== CHANGING SERIAL PORT ===', file=sys.stderr)
-        print(f'New port: {new_port}', file=sys.stderr)
+        socketio.start_background_task(change_serial_port, new_port)
+    except Exception as e:
+        port_change_lock.release()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    return jsonify({
+        'success': True,
+        'status': 'connecting',
+        'message': f'Connecting to {new_port}...',
+        'port': new_port
+    }), 202
+
+def change_serial_port(new_port):
+    """Background task of /api/set_port, releases port_change_lock when done"""
+    global pload
+
+    try:
+        log.info('=== CHANGING SERIAL PORT ===')
+        log.info('New port: %s', new_port)
 
         # Close existing connection
         if pload and pload.instr and pload.instr.comm:
-            print('Closing existing connection...', file=sys.stderr)
-            pload.instr.close()
+            log.info('Closing existing connection...')
+            device_call(pload.instr.close)
 
         # Update config file
         config_path = os.path.expanduser('~/.dl24.cfg')
-        config_lines = []
-        port_updated = False
-
-        if os.path.exists(config_path):
-            with open(config_path, 'r') as f:
-                for line in f:
-                    if line.strip().startswith('serport='):
-                        config_lines.append(f'serport={new_port}\n')
-                        port_updated = True
-                    else:
-                        config_lines.append(line)
-
-        # If serport wasn't in config, add it
-        if not port_updated:
-            config_lines.append(f'serport={new_port}\n')
+        update_config_serport(config_path, new_port)
 
-        # Write updated config
-        with open(config_path, 'w') as f:
-            f.writelines(config_lines)
-
-        print(f'Config file updated: {config_path}', file=sys.stderr)
+        log.info('Config file updated: %s', config_path)
 
         # Reinitialize device with new port
-        if not init_device():
-            return jsonify({
+        if not device_call(init_device):
+            result = {
                 'success': False,
-                'error': f'Could not connect to {new_port}'
-            }), 500
-
-        print(f'✅ Successfully connected to {new_port}', file=sys.stderr)
-
-        return jsonify({
-            'success': True,
-            'message': f'Connected to {new_port}',
-            'port': new_port
-        })
+                'error': f'Could not connect to {new_port}',
+                'port': new_port
+            }
+        else:
+            log.info('✅ Successfully connected to %s', new_port)
+            result = {
+                'success': True,
+                'message': f'Connected to {new_port}',
+                'port': new_port
+            }
 
     except Exception as e:
-        print(f'❌ Error changing port: {e}', file=sys.stderr)
-        return jsonify({'success': False, 'error': str(e)}), 500
+        log.error('❌ Error changing port: %s', e)
+        result = {'success': False, 'error': str(e), 'port': new_port}
+    finally:
+        # Opening a port can change its listing (or show that it is gone)
+        invalidate_ports_cache()
+        port_change_lock.release()
+
+    socketio.emit('port_status', result)
+
+# Startup messages, each written in one go
+NO_DEVICE_MESSAGE = '\n'.join([
+    'WARNING: Could not initialize device.',
+    'You can configure the connection in the web interface.',
+    'Select serial port and click Connect.'
+])
+READY_BANNER = '\n'.join([
+    'Background data update thread started',
+    '',
+    'Web server ready!',
+    'Open http://localhost:5000 in your browser',
+    'Press Ctrl+C to stop',
+    ''
+])
 
 def main():
     """Main entry point"""
     global update_thread, pload
 
+    # DL24_LOG=DEBUG/WARNING/... overrides the default level
+    logging.basicConfig(level=os.environ.get('DL24_LOG', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(message)s')
+
     print('DL24P Web Server starting...')
 
     # Initialize pload object (needed for API even without connection)
@@ -839,31 +1565,45 @@ def main():
     print('Initializing device connection...')
 
     if not init_device():
-        print('WARNING: Could not initialize device.')
-        print('You can configure the connection in the web interface.')
-        print('Select serial port and click Connect.')
+        print(NO_DEVICE_MESSAGE)
     else:
         print('Device connected successfully!')
 
+    publish_state()
+
     # Start background update thread
     update_thread = threading.Thread(target=update_data, daemon=True)
     update_thread.start()
-    print('Background data update thread started')
 
     # Start Flask server
-    print('\nWeb server ready!')
-    print('Open http://localhost:5000 in your browser')
-    print('Press Ctrl+C to stop\n')
+    print(READY_BANNER, flush=True)
+    signal.signal(signal.SIGTERM, handle_sigterm)
 
     try:
-        socketio.run(app, host='0.0.0.0', port=5000, debug=False, allow_unsafe_werkzeug=True)
+        if ASYNC_MODE == 'threading' and os.environ.get('DL24_SERVER') == 'waitress':
+            # Production WSGI server; without WebSocket support the page's
+            # socket.io client falls back to long-polling
+            from waitress import serve
+            serve(app, host='0.0.0.0', port=5000, threads=8)
+        elif ASYNC_MODE == 'threading':
+            socketio.run(app, host='0.0.0.0', port=5000, debug=False, allow_unsafe_werkzeug=True)
+        else:
+            socketio.run(app, host='0.0.0.0', port=5000, debug=False)
     except KeyboardInterrupt:
-        print('\nShutting down...')
-        if pload and pload.instr and pload.instr.comm:
-            if test_state['running']:
-                pload.instr.cmd_setonoff(0)
-            pload.instr.close()
-        print('Goodbye!')
+        pass  # waitress returns on Ctrl+C instead of raising
+
+    # Never leave the load switched on behind a stopped server
+    print('\nShutting down...')
+    if pload and pload.instr and pload.instr.comm:
+        if test_state['running']:
+            device_call(pload.instr.cmd_setonoff, 0)
+        device_call(pload.instr.close)
+    test_state['data_points'].discard()
+    print('Goodbye!')
+
+def handle_sigterm(signum, frame):
+    """Take the Ctrl+C shutdown path on SIGTERM (systemd, docker stop)"""
+    raise KeyboardInterrupt
 
 if __name__ == '__main__':
     main()
@@ -4,27 +4,77 @@
 Executes multi-phase test cycles defined in JSON format
 """
 
+import functools
 import json
+import math
+import os
+import queue
+import threading
 import time
 import sys
+from collections import deque, namedtuple
 from datetime import datetime
 
+CSV_HEADER = ('timestamp,elapsed_s,phase,phase_type,voltage_v,current_a,'
+              'capacity_mah,energy_mwh,temperature_c\n')
+CSV_ROW = '{},{:.1f},{},{},{:.3f},{:.3f},{:.1f},{:.1f},{:.1f}\n'.format
+CSV_BUFFER_SIZE = 1 << 16
+CYCLE_DATA_WINDOW = 3600  # Datapoints kept in memory, the CSV file gets all of them
+WRITER_QUEUE_SIZE = 1024  # Datapoints waiting for the writer before the oldest is dropped
+MAX_CHECK_INTERVAL = 2.0  # Longest time between cutoff voltage checks during discharge
+
+# One logged sample, time is its time.monotonic() reading; fields after it in CSV column order
+DataPoint = namedtuple('DataPoint', ['time', 'elapsed', 'phase', 'phase_type', 'voltage', 'current',
+                                     'capacity_mah', 'energy_mwh', 'temperature'])
+
+def csv_row(dp, wall_offset):
+    """Format a datapoint as a CSV line, wall_offset maps its monotonic time to Unix time"""
+    timestamp = datetime.fromtimestamp(dp.time + wall_offset).isoformat()
+    if None in dp:  # failed read, leave its fields empty
+        return ','.join([timestamp] + ['' if v is None else str(v) for v in dp[1:]]) + '\n'
+    return CSV_ROW(timestamp, *dp[1:])
+
+@functools.lru_cache(maxsize=8)
+def _load_cached(path, mtime_ns):
+    """Parse a test cycle file, once per path and modification time"""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def read_test_cycles(filename):
+    """Return the test cycle definitions in filename (shared, do not modify)"""
+    path = os.path.abspath(filename)
+    return _load_cached(path, os.stat(path).st_mtime_ns)['test_cycles']
+
 class TestCycleExecutor:
     def __init__(self, instr, test_cycle_file='test_cycles_18650.json'):
         self.instr = instr
-        self.test_cycles = self.load_test_cycles(test_cycle_file)
+        self.test_cycle_file = test_cycle_file  # read on first use of test_cycles
         self.current_cycle = None
         self.current_phase = None
         self.phase_start_time = None
-        self.cycle_data = []
-        self.running = False
+        self.cycle_data = deque(maxlen=CYCLE_DATA_WINDOW)  # recent datapoints
+        self._stop_evt = threading.Event()  # set while no cycle is running
+        self._stop_evt.set()
+        self.data_file = None  # CSV file the datapoints are streamed to
+        self.rows_written = 0
+        self._writer_q = None
+        self._writer = None
+        self._reset_summary()
+
+    @functools.cached_property
+    def test_cycles(self):
+        """Test cycle definitions from test_cycle_file"""
+        return self.load_test_cycles(self.test_cycle_file)
+
+    @property
+    def running(self):
+        """True while a cycle is running and stop() was not called"""
+        return not self._stop_evt.is_set()
 
     def load_test_cycles(self, filename):
         """Load test cycle definitions from JSON file"""
         try:
-            with open(filename, 'r') as f:
-                data = json.load(f)
-                return data['test_cycles']
+            return read_test_cycles(filename)
         except Exception as e:
             print(f'Error loading test cycles: {e}', file=sys.stderr)
             return {}
@@ -39,14 +89,16 @@ class TestCycleExecutor:
             return self.test_cycles[cycle_name]
         return None
 
-    def start_cycle(self, cycle_name):
-        """Start executing a test cycle"""
+    def start_cycle(self, cycle_name, filename=None):
+        """Start executing a test cycle, streaming its data to filename"""
         if cycle_name not in self.test_cycles:
             raise ValueError(f'Unknown test cycle: {cycle_name}')
 
         self.current_cycle = self.test_cycles[cycle_name]
-        self.running = True
-        self.cycle_data = []
+        self._stop_evt.clear()
+        self.cycle_data.clear()
+        self._reset_summary()
+        self._start_writer(filename)
 
         print(f'Starting test cycle: {self.current_cycle["name"]}')
         print(f'Description: {self.current_cycle["description"]}')
@@ -57,7 +109,7 @@ class TestCycleExecutor:
     def execute_phase(self, phase, phase_num, total_phases):
         """Execute a single phase of the test cycle"""
         self.current_phase = phase
-        self.phase_start_time = time.time()
+        self.phase_start_time = time.monotonic()
 
         print(f'\n=== Phase {phase_num}/{total_phases}: {phase["name"]} ===')
         print(f'Description: {phase["description"]}')
@@ -82,14 +134,28 @@ class TestCycleExecutor:
         # Turn off load
         self.instr.cmd_setonoff(0)
 
-        start_time = time.time()
-        while time.time() - start_time < duration:
-            if not self.running:
-                return False
+        # Loop-invariant lookups bound once
+        log_datapoint = self._log_datapoint
+        monotonic = time.monotonic
+        stopped = self._stop_evt.wait  # sleeps, returns True at once on stop()
+
+        tick = 1.0
+        start_time = monotonic()
+        end_time = start_time + duration
+        deadline = start_time
+        while True:
+            now = monotonic()
+            if now >= end_time:
+                break
 
             # Log data during rest
-            self._log_datapoint('rest')
-            time.sleep(1)
+            log_datapoint('rest')
+
+            # Sleep until the next tick, so logging time does not add up; after a
+            # slow read carry on from now, and never wait past the end of the rest
+            deadline = min(max(deadline + tick, now), end_time)
+            if stopped(max(0, deadline - monotonic())):
+                return False
 
         print('Rest phase completed')
         return True
@@ -101,56 +167,72 @@ class TestCycleExecutor:
         max_time = phase.get('max_time', float('inf'))
         duration = phase.get('duration', None)
         log_interval = phase.get('log_interval', 5)
+        to_cutoff = not duration  # no fixed duration: run until cutoff voltage or max_time
 
         print(f'Discharge at {current}A')
-        if duration:
+        if not to_cutoff:
             print(f'Duration: {duration} seconds')
         else:
             print(f'Cutoff voltage: {cutoff_voltage}V, Max time: {max_time}s')
 
-        # Set current and turn on load
-        self.instr.cmd_setcurrent(current)
-        self.instr.cmd_setcutoff(cutoff_voltage)
-        self.instr.cmd_setonoff(1)
+        # Set current and cutoff, then turn on load
+        if not self.instr.cmd_setup_discharge(current, cutoff_voltage):
+            print('Cannot set up the load for discharge', file=sys.stderr)
+            self.instr.cmd_setonoff(0)
+            return False
 
-        start_time = time.time()
-        last_log = 0
+        # Loop-invariant lookups bound once
+        getvolt = self.instr.cmd_getvolt
+        log_datapoint = self._log_datapoint
+        monotonic = time.monotonic
+        stopped = self._stop_evt.wait  # sleeps, returns True at once on stop()
+
+        # Every voltage read is a serial round trip, and the voltage falls slowly:
+        # check it a few times per log interval, at most MAX_CHECK_INTERVAL apart
+        checks_per_log = max(1, math.ceil(log_interval / MAX_CHECK_INTERVAL))
+        tick = log_interval / checks_per_log
+        start_time = monotonic()
+        end_time = start_time + (max_time if to_cutoff else duration)
+        deadline = start_time
+        ticks = 0
 
         while True:
-            if not self.running:
-                self.instr.cmd_setonoff(0)
-                return False
-
-            elapsed = time.time() - start_time
-
-            # Check termination conditions
-            voltage = self.instr.cmd_getvolt()
-
-            # If duration specified, use that
-            if duration and elapsed >= duration:
-                print(f'Duration limit reached: {elapsed:.1f}s')
+            now = monotonic()
+            elapsed = now - start_time
+
+            # Log data at specified interval, the logged reading also serves the checks
+            log_now = ticks > 0 and ticks % checks_per_log == 0
+            ticks += 1
+            if log_now:
+                datapoint = log_datapoint('discharge')
+                voltage = datapoint.voltage
+            elif to_cutoff:
+                voltage = getvolt()
+
+            # Check termination conditions, the cutoff voltage goes first
+            if to_cutoff and voltage <= cutoff_voltage:
+                print(f'Cutoff voltage reached: {voltage:.3f}V')
                 break
 
-            # Otherwise check voltage and time
-            if not duration:
-                if voltage <= cutoff_voltage:
-                    print(f'Cutoff voltage reached: {voltage:.3f}V')
-                    break
-
-                if elapsed >= max_time:
+            # The duration, or max_time when running to cutoff, is over
+            if now >= end_time:
+                if to_cutoff:
                     print(f'Max time reached: {elapsed:.1f}s')
-                    break
-
-            # Log data at specified interval
-            if elapsed - last_log >= log_interval:
-                self._log_datapoint('discharge')
-                last_log = elapsed
+                else:
+                    print(f'Duration limit reached: {elapsed:.1f}s')
+                break
 
+            if log_now:
                 # Print status
-                capacity = self.instr.cmd_getah(div=1)
+                capacity = datapoint.capacity_mah
                 print(f'  {elapsed:.0f}s: {voltage:.3f}V, {current:.3f}A, {capacity:.0f}mAh')
 
-            time.sleep(0.5)
+            # Keep a fixed sampling rate; after a slow serial read carry on from now.
+            # The last wait ends when the phase time is up, not a tick later.
+            deadline = min(max(deadline + tick, now), end_time)
+            if stopped(max(0, deadline - monotonic())):
+                self.instr.cmd_setonoff(0)
+                return False
 
         self.instr.cmd_setonoff(0)
         print('Discharge phase completed')
@@ -167,44 +249,140 @@ class TestCycleExecutor:
 
         step_duration = duration / steps
         current_step = (end_current - start_current) / steps
-
-        for step in range(steps):
-            if not self.running:
+        # Current of each step, the last step ends one increment below end_current
+        currents = [start_current + current_step * step for step in range(steps)]
+
+        # Loop-invariant lookups bound once
+        setcurrent = self.instr.cmd_setcurrent
+        log_datapoint = self._log_datapoint
+        monotonic = time.monotonic
+        stopped = self._stop_evt.wait  # sleeps, returns True at once on stop()
+
+        start_time = monotonic()
+        for step, current in enumerate(currents):
+            if step > 0:
+                setcurrent(current)
+            elif not self.instr.cmd_setup_discharge(current):
+                print('Cannot set up the load for the ramp', file=sys.stderr)
                 self.instr.cmd_setonoff(0)
                 return False
 
-            current = start_current + (current_step * step)
-            self.instr.cmd_setcurrent(current)
-
-            if step == 0:
-                self.instr.cmd_setonoff(1)
-
             # Log data
-            self._log_datapoint('ramp')
-
-            voltage = self.instr.cmd_getvolt()
+            voltage = log_datapoint('ramp').voltage
             print(f'  Step {step+1}/{steps}: {current:.2f}A, {voltage:.3f}V')
 
-            time.sleep(step_duration)
+            # Steps end on a fixed schedule, the device commands do not stretch the ramp
+            if stopped(max(0, start_time + (step + 1) * step_duration - monotonic())):
+                self.instr.cmd_setonoff(0)
+                return False
 
         print('Ramp phase completed')
         return True
 
     def _log_datapoint(self, phase_type):
-        """Log a data point during test execution"""
-        datapoint = {
-            'timestamp': datetime.now().isoformat(),
-            'elapsed': time.time() - self.phase_start_time if self.phase_start_time else 0,
-            'phase': self.current_phase['name'] if self.current_phase else 'unknown',
-            'phase_type': phase_type,
-            'voltage': self.instr.cmd_getvolt(),
-            'current': self.instr.cmd_getamp(),
-            'capacity_mah': self.instr.cmd_getah(div=1),
-            'energy_mwh': self.instr.cmd_getwh(div=1),
-            'temperature': self.instr.cmd_gettemp()
-        }
+        """Log a data point during test execution and return it"""
+        readings = self.instr.cmd_getall()
+        now = time.monotonic()  # the writer turns it into the wall-clock timestamp
+        datapoint = DataPoint(
+            time=now,
+            elapsed=now - self.phase_start_time if self.phase_start_time else 0,
+            phase=self.current_phase['name'] if self.current_phase else 'unknown',
+            phase_type=phase_type,
+            voltage=readings['voltage'],
+            current=readings['current'],
+            capacity_mah=readings['capacity_mah'],
+            energy_mwh=readings['energy_mwh'],
+            temperature=readings['temperature']
+        )
         self.cycle_data.append(datapoint)
 
+        rows = self._writer_q
+        if rows is not None:
+            try:
+                rows.put_nowait(datapoint)
+            except queue.Full:
+                # Writer is stalled, drop the oldest row instead of blocking the phase loop
+                try:
+                    rows.get_nowait()
+                except queue.Empty:
+                    pass  # drained meanwhile
+                rows.put_nowait(datapoint)
+        self._add_to_summary(datapoint)
+        return datapoint
+
+    def _reset_summary(self):
+        """Start the running cycle summary over"""
+        self._summary = {'samples': 0, 'duration_s': 0.0, 'capacity_mah': 0.0, 'energy_mwh': 0.0,
+                         'min_voltage': None, 'max_temperature': None}
+        self._summary_prev = None
+
+    def _add_to_summary(self, dp):
+        """Fold a datapoint into the running cycle summary"""
+        if dp.voltage is None or dp.current is None:
+            return  # failed read
+        s = self._summary
+        prev = self._summary_prev
+        s['samples'] += 1
+        if prev is not None:
+            # Trapezoid between the two samples; (a + b) / 2 * dt in A*s is (a + b) * dt / 7.2 in mAh
+            dt = dp.time - prev.time
+            s['duration_s'] += dt
+            s['capacity_mah'] += (prev.current + dp.current) * dt / 7.2
+            s['energy_mwh'] += (prev.voltage * prev.current + dp.voltage * dp.current) * dt / 7.2
+        if s['min_voltage'] is None or dp.voltage < s['min_voltage']:
+            s['min_voltage'] = dp.voltage
+        if dp.temperature is not None and (s['max_temperature'] is None or dp.temperature > s['max_temperature']):
+            s['max_temperature'] = dp.temperature
+        self._summary_prev = dp
+
+    def summarize(self):
+        """Totals of the cycle so far, integrated from the logged current and power"""
+        return dict(self._summary)
+
+    def _start_writer(self, filename=None):
+        """Open the CSV file and start the thread writing datapoints to it"""
+        self._stop_writer()  # previous cycle that was never exported
+        if not filename:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f'test_cycle_{timestamp}.csv'
+
+        self.data_file = filename
+        self.rows_written = 0
+        self._writer_q = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+        wall_offset = time.time() - time.monotonic()
+        self._writer = threading.Thread(target=self._write_rows,
+                                        args=(open(filename, 'w', buffering=CSV_BUFFER_SIZE), self._writer_q, wall_offset),
+                                        daemon=True)
+        self._writer.start()
+
+    def _write_rows(self, f, rows, wall_offset):
+        """Writer thread, appends queued datapoints to the CSV file until None arrives"""
+        done = False
+        with f:
+            f.write(CSV_HEADER)
+            while not done:
+                # Take everything that queued up meanwhile and write it in one go
+                batch = [rows.get()]
+                try:
+                    while True:
+                        batch.append(rows.get_nowait())
+                except queue.Empty:
+                    pass
+                if None in batch:
+                    done = True
+                    del batch[batch.index(None):]
+                f.write(''.join([csv_row(dp, wall_offset) for dp in batch]))
+                self.rows_written += len(batch)
+                f.flush()  # keep the file current while waiting for the next sample
+
+    def _stop_writer(self):
+        """Write out the queued datapoints and close the CSV file"""
+        if self._writer is None:
+            return
+        self._writer_q.put(None)
+        self._writer.join()
+        self._writer = self._writer_q = None
+
     def run_cycle(self, cycle_name):
         """Run a complete test cycle"""
         if not self.start_cycle(cycle_name):
@@ -224,42 +402,33 @@ class TestCycleExecutor:
 
     def stop(self):
         """Stop the current test cycle"""
-        self.running = False
+        self._stop_evt.set()  # wakes the phase loop from its wait
         self.instr.cmd_setonoff(0)
+        self._stop_writer()  # keep what was recorded so far
 
     def export_data(self, filename=None):
-        """Export cycle data to CSV"""
-        if not filename:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f'test_cycle_{timestamp}.csv'
+        """Finish the CSV file the cycle data was streamed to, renaming it to filename if given"""
+        self._stop_writer()
 
-        if not self.cycle_data:
+        if not self.data_file:
+            print('No data to export')
+            return False
+        if not self.rows_written:
+            os.remove(self.data_file)  # header only
+            self.data_file = None
             print('No data to export')
             return False
 
-        with open(filename, 'w') as f:
-            # Write header
-            headers = ['timestamp', 'elapsed_s', 'phase', 'phase_type',
-                      'voltage_v', 'current_a', 'capacity_mah',
-                      'energy_mwh', 'temperature_c']
-            f.write(','.join(headers) + '\n')
-
-            # Write data
-            for dp in self.cycle_data:
-                row = [
-                    dp['timestamp'],
-                    f"{dp['elapsed']:.1f}",
-                    dp['phase'],
-                    dp['phase_type'],
-                    f"{dp['voltage']:.3f}",
-                    f"{dp['current']:.3f}",
-                    f"{dp['capacity_mah']:.1f}",
-                    f"{dp['energy_mwh']:.1f}",
-                    f"{dp['temperature']:.1f}"
-                ]
-                f.write(','.join(row) + '\n')
-
-        print(f'Data exported to {filename}')
+        if filename and filename != self.data_file:
+            os.replace(self.data_file, filename)
+            self.data_file = filename
+
+        print(f'Data exported to {self.data_file}')
+        summary = self.summarize()
+        if summary['samples']:
+            print(f"Summary: {summary['samples']} samples over {summary['duration_s']:.0f}s, "
+                  f"{summary['capacity_mah']:.0f}mAh, {summary['energy_mwh']:.0f}mWh, "
+                  f"min {summary['min_voltage']:.3f}V")
         return True
 
 
@@ -273,10 +442,8 @@ if __name__ == '__main__':
 
         # Load and list cycles
         try:
-            with open('test_cycles_18650.json', 'r') as f:
-                data = json.load(f)
-                for name, cycle in data['test_cycles'].items():
-                    print(f'  {name}: {cycle["name"]} - {cycle["description"]}')
+            for name, cycle in read_test_cycles('test_cycles_18650.json').items():
+                print(f'  {name}: {cycle["name"]} - {cycle["description"]}')
         except Exception as e:
             print(f'Error: {e}')
         sys.exit(1)